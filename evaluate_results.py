@@ -1,85 +1,161 @@
 import os
-import json
+import orjson
+import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 import seaborn as sns
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 
 
 RESULTS_DIR = "results"
 OUTPUT_DIR = "evaluation_outputs"
+RESULTS_CACHE = "results_cache.parquet"
+CACHE_SOURCES_KEY = b"source_files"   # Parquet metadata key listing the cached files
+LOAD_WORKERS = 8   # threads used to read and parse result files
+
+# Fields stored for every answer in the result JSON files
+RESULT_FIELDS = [
+    "model", "prompt", "filename", "foldername",
+    "object", "flag", "gpt_raw_answer",
+]
+
+# Columns the metric computations actually read
+METRIC_COLUMNS = [
+    "model", "prompt", "object", "foldername",
+    "flag", "gpt_raw_answer_norm",
+]
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
 # Normalize GPT answer to yes/no/unknown
 
-def normalize_answer(ans):
-    if not isinstance(ans, str):
-        return "unknown"
-    ans = ans.strip().lower()
-    if ans.startswith("y"):
-        return "yes"
-    if ans.startswith("n"):
-        return "no"
-    return "unknown"
-
+def normalize_answer(answers):
+    first = answers.astype("string").str.strip().str.lower().str[0]
+    return np.select(
+        [
+            first.eq("y").to_numpy(dtype=bool, na_value=False),
+            first.eq("n").to_numpy(dtype=bool, na_value=False),
+        ],
+        ["yes", "no"],
+        default="unknown"
+    )
 
-# Load all JSON results into a single DataFrame
 
-def load_all_results():
-    rows = []
+# Load all JSON results into a single Parquet cache
+
+def parse_result_file(jf):
+    with open(jf, "rb") as f:
+        return os.path.basename(jf), orjson.loads(f.read())
+
+
+def results_cache_is_fresh(json_files):
+    # The Parquet cache is valid while it is newer than every result file
+    # and was built from exactly the same set of files (catches deletes/renames).
+    # The source file list lives in the Parquet footer metadata, so files
+    # holding no rows count too and the check never reads the data itself.
+    if not json_files or not os.path.exists(RESULTS_CACHE):
+        return False
+    newest = max(os.path.getmtime(jf) for jf in json_files)
+    if os.path.getmtime(RESULTS_CACHE) < newest:
+        return False
+    metadata = pq.read_schema(RESULTS_CACHE).metadata or {}
+    if CACHE_SOURCES_KEY not in metadata:
+        return False
+    cached_files = set(orjson.loads(metadata[CACHE_SOURCES_KEY]))
+    return cached_files == {os.path.basename(jf) for jf in json_files}
+
+
+def write_results_cache(json_files):
+    # Build the DataFrame column-wise instead of from a list of row dicts
+    columns = {field: [] for field in RESULT_FIELDS}
+    columns["filepath"] = []
+
+    # Read + parse files in parallel; map keeps the original file order
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as ex:
+        parsed = list(ex.map(parse_result_file, json_files))
+
+    for name, data in parsed:
+        for field in RESULT_FIELDS:
+            columns[field].extend(item.get(field) for item in data)
+        columns["filepath"].extend([name] * len(data))
+
+    df = pd.DataFrame(columns)
+    df["gpt_raw_answer_norm"] = normalize_answer(df["gpt_raw_answer"])
+
+    # Group-by keys have few distinct values: store them as categories
+    for col in ("model", "prompt", "object", "foldername"):
+        df[col] = df[col].astype("category")
+
+    # Record which result files the cache was built from
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sources = sorted(os.path.basename(jf) for jf in json_files)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        CACHE_SOURCES_KEY: orjson.dumps(sources),
+    })
+    pq.write_table(table, RESULTS_CACHE, compression="zstd")
+
+
+def scan_results():
+    # Lazy scan of the Parquet cache: only the metric columns are read,
+    # and Polars streams them straight into the group-bys
     json_files = glob(os.path.join(RESULTS_DIR, "*.json"))
 
-    for jf in json_files:
-        with open(jf, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        for item in data:
-            item["filepath"] = os.path.basename(jf)
-            item["gpt_raw_answer_norm"] = normalize_answer(item["gpt_raw_answer"])
-            rows.append(item)
-
-    df = pd.DataFrame(rows)
-    return df
-
+    if not results_cache_is_fresh(json_files):
+        write_results_cache(json_files)
+    return pl.scan_parquet(RESULTS_CACHE).select(METRIC_COLUMNS)
 
-# Compute hallucination metrics
 
-def compute_overall_metrics(df):
-    df["is_fp"] = (df["flag"] == 0) & (df["gpt_raw_answer_norm"] == "yes")
+# Compute hallucination metrics (lazy Polars plans, collected together in compute_all)
+# The compute_* functions expect the is_fp column added by add_fp_flag
 
-    grouped = df.groupby(["model", "prompt"]).agg(
-        total=("object", "count"),
-        fp=("is_fp", "sum")
-    ).reset_index()
-
-    grouped["hallucination_rate"] = grouped["fp"] / grouped["total"]
-
-    return grouped
+def add_fp_flag(lf):
+    # False positive: object is absent (flag == 0) but the model said "yes"
+    return lf.with_columns(
+        is_fp=(pl.col("flag") == 0) & (pl.col("gpt_raw_answer_norm") == "yes")
+    )
 
 
-def compute_object_level(df):
-    df["is_fp"] = (df["flag"] == 0) & (df["gpt_raw_answer_norm"] == "yes")
+def compute_overall_metrics(lf):
+    return (
+        lf.group_by(["model", "prompt"])
+        .agg(total=pl.len(), fp=pl.col("is_fp").sum())
+        .with_columns(hallucination_rate=pl.col("fp") / pl.col("total"))
+        .sort(["model", "prompt"])
+    )
 
-    g = df.groupby(["model", "prompt", "object"]).agg(
-        total=("object", "count"),
-        fp=("is_fp", "sum")
-    ).reset_index()
 
-    g["hallucination_rate"] = g["fp"] / g["total"]
-    return g
+def compute_object_level(lf):
+    return (
+        lf.group_by(["model", "prompt", "object"])
+        .agg(total=pl.len(), fp=pl.col("is_fp").sum())
+        .with_columns(hallucination_rate=pl.col("fp") / pl.col("total"))
+        .sort(["model", "prompt", "object"])
+    )
 
 
-def compute_folder_level(df):
-    df["is_fp"] = (df["flag"] == 0) & (df["gpt_raw_answer_norm"] == "yes")
+def compute_folder_level(lf):
+    return (
+        lf.group_by(["model", "prompt", "foldername"])
+        .agg(total=pl.len(), fp=pl.col("is_fp").sum())
+        .with_columns(hallucination_rate=pl.col("fp") / pl.col("total"))
+        .sort(["model", "prompt", "foldername"])
+    )
 
-    g = df.groupby(["model", "prompt", "foldername"]).agg(
-        total=("object", "count"),
-        fp=("is_fp", "sum")
-    ).reset_index()
 
-    g["hallucination_rate"] = g["fp"] / g["total"]
-    return g
+def compute_all(lf):
+    # One collect_all over the three plans, so Polars scans the input once
+    overall, obj_level, folder_level = pl.collect_all([
+        compute_overall_metrics(lf),
+        compute_object_level(lf),
+        compute_folder_level(lf),
+    ])
+    return overall, obj_level, folder_level
 
 
 # Visualization Helpers
@@ -100,60 +176,89 @@ def plot_overall_bar(df):
     plt.close()
 
 
+def draw_heatmap(pivot, cmap, title, figsize, out_name):
+    # imshow draws the whole grid as one image instead of one artist per cell
+    fig, ax = plt.subplots(figsize=figsize)
+    values = pivot.to_numpy(dtype=float)
+    im = ax.imshow(values, cmap=cmap, aspect="auto", interpolation="none")
+    fig.colorbar(im, ax=ax)
+
+    ax.set_xticks(range(len(pivot.columns)))
+    ax.set_xticklabels(pivot.columns, rotation=45, ha="right")
+    ax.set_yticks(range(len(pivot.index)))
+    ax.set_yticklabels(pivot.index)
+    ax.set_xlabel(pivot.columns.name)
+    ax.set_ylabel(pivot.index.name)
+
+    # Cell annotations only while the grid is small enough to read
+    if pivot.size < 200:
+        mid = (np.nanmin(values) + np.nanmax(values)) / 2
+        for i in range(values.shape[0]):
+            for j in range(values.shape[1]):
+                if np.isnan(values[i, j]):
+                    continue
+                ax.text(
+                    j, i, f"{values[i, j]:.2f}",
+                    ha="center", va="center",
+                    color="white" if values[i, j] > mid else "black"
+                )
+
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(os.path.join(OUTPUT_DIR, out_name))
+    plt.close(fig)
+
+
 def plot_object_heatmap(df):
     pivot = df.pivot_table(
         index="object",
         columns="prompt",
-        values="hallucination_rate"
+        values="hallucination_rate",
+        observed=True
     )
 
-    plt.figure(figsize=(12, 10))
-    sns.heatmap(pivot, annot=True, fmt=".2f", cmap="Reds")
-    plt.title("Object-level Hallucination Heatmap")
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUTPUT_DIR, "object_hallucination_heatmap.png"))
-    plt.close()
+    draw_heatmap(
+        pivot, "Reds", "Object-level Hallucination Heatmap",
+        (12, 10), "object_hallucination_heatmap.png"
+    )
 
 
 def plot_folder_heatmap(df):
     pivot = df.pivot_table(
         index="foldername",
         columns="prompt",
-        values="hallucination_rate"
+        values="hallucination_rate",
+        observed=True
     )
 
-    plt.figure(figsize=(10, 6))
-    sns.heatmap(pivot, annot=True, fmt=".2f", cmap="Blues")
-    plt.title("Folder-level Hallucination Heatmap")
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUTPUT_DIR, "folder_hallucination_heatmap.png"))
-    plt.close()
+    draw_heatmap(
+        pivot, "Blues", "Folder-level Hallucination Heatmap",
+        (10, 6), "folder_hallucination_heatmap.png"
+    )
 
 
 # MAIN
 
 def main():
     print("Loading JSON result files...")
-    df = load_all_results()
-    print(f"Loaded {len(df)} rows.")
+    lf = add_fp_flag(scan_results())
 
     # Compute evaluation
-    overall = compute_overall_metrics(df)
-    obj_level = compute_object_level(df)
-    folder_level = compute_folder_level(df)
+    overall, obj_level, folder_level = compute_all(lf)
+    print(f"Loaded {overall['total'].sum()} rows.")
 
     # Save CSVs
-    overall.to_csv(os.path.join(OUTPUT_DIR, "overall_metrics.csv"), index=False)
-    obj_level.to_csv(os.path.join(OUTPUT_DIR, "object_level_metrics.csv"), index=False)
-    folder_level.to_csv(os.path.join(OUTPUT_DIR, "folder_level_metrics.csv"), index=False)
+    overall.write_csv(os.path.join(OUTPUT_DIR, "overall_metrics.csv"))
+    obj_level.write_csv(os.path.join(OUTPUT_DIR, "object_level_metrics.csv"))
+    folder_level.write_csv(os.path.join(OUTPUT_DIR, "folder_level_metrics.csv"))
 
     print("CSV files saved.")
 
     # Plots
     print("Generating graphs...")
-    plot_overall_bar(overall)
-    plot_object_heatmap(obj_level)
-    plot_folder_heatmap(folder_level)
+    plot_overall_bar(overall.to_pandas())
+    plot_object_heatmap(obj_level.to_pandas())
+    plot_folder_heatmap(folder_level.to_pandas())
 
     print("All evaluation outputs saved to:", OUTPUT_DIR)
 
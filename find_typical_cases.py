@@ -1,83 +1,105 @@
 import os
 import json
+import numpy as np
 import pandas as pd
+from glob import glob
 
 RESULTS_DIR = "results"
 MODEL_NAME = "gpt-5.1"
 
+# Prompts compared, with the column suffix used for each
+PROMPT_SUFFIXES = {"baseline": "base", "misleading1": "mis", "mitigate1": "miti"}
+
 
 # Helper: normalize GPT answers
 
-def normalize(ans):
-    if not isinstance(ans, str):
-        return "unknown"
-    ans = ans.lower().strip()
-    if ans.startswith("y"):
-        return "yes"
-    if ans.startswith("n"):
-        return "no"
-    return "unknown"
+def normalize(answers):
+    first = answers.astype("string").str.lower().str.strip().str[0]
+    return np.select(
+        [
+            first.eq("y").to_numpy(dtype=bool, na_value=False),
+            first.eq("n").to_numpy(dtype=bool, na_value=False),
+        ],
+        ["yes", "no"],
+        default="unknown"
+    )
 
 
 # Load results for gpt-5.1 only
 
 def load_results(model):
-    files = [
-        f for f in os.listdir(RESULTS_DIR)
-        if f.startswith(model)
-    ]
+    files = glob(os.path.join(RESULTS_DIR, f"{model}_*.json"))
 
     rows = []
     for fpath in files:
-        full = os.path.join(RESULTS_DIR, fpath)
-        with open(full, "r", encoding="utf-8") as f:
+        with open(fpath, "r", encoding="utf-8") as f:
             data = json.load(f)
 
-        for item in data:
-            item["prompt"] = item["prompt"]
-            item["gpt_norm"] = normalize(item["gpt_raw_answer"])
-            item["model"] = item["model"]
-            rows.append(item)
+        rows.extend(data)
+
+    df = pd.DataFrame(rows)
+    df["gpt_norm"] = normalize(df["gpt_raw_answer"])
 
-    return pd.DataFrame(rows)
+    # Few distinct prompts: compare/group on integer codes, not strings
+    df["prompt"] = df["prompt"].astype("category")
+    return df
 
 
 # Find two typical cases
 
 def find_cases(df):
 
-    # Only analyze prompts we care about
-    base = df[df["prompt"] == "baseline"]
-    mis  = df[df["prompt"] == "misleading1"]
-    miti = df[df["prompt"] == "mitigate1"]
-
-    # Merge on filename + object
-    merge_base_mis = pd.merge(
-        base, mis, 
-        on=["filename", "object", "foldername", "flag"],
-        suffixes=("_base", "_mis")
+    # Baseline rows first, so the pivot keeps the baseline file's row order
+    # (as the old merges did) whatever order the result files were listed in
+    df = df.sort_values("prompt", key=lambda p: p != "baseline", kind="stable")
+
+    # One row per (image, object), raw + normalized answer columns per prompt
+    keys = ["filename", "foldername", "object", "flag"]
+    wide = df.pivot_table(
+        index=keys,
+        columns="prompt",
+        values=["gpt_raw_answer", "gpt_norm"],
+        aggfunc="first",
+        observed=True,
+        sort=False
     )
 
-    merge_base_miti = pd.merge(
-        base, miti,
-        on=["filename", "object", "foldername", "flag"],
-        suffixes=("_base", "_miti")
-    )
+    # sort=False alone does not fully keep row order, so restore it explicitly
+    first_seen = pd.MultiIndex.from_frame(df[keys].drop_duplicates())
+    wide = wide.reindex(first_seen)
+
+    # Only analyze prompts we care about (missing prompt runs stay empty),
+    # named like the old merge columns, e.g. gpt_norm_base / gpt_raw_answer_mis
+    wide = wide.reindex(columns=pd.MultiIndex.from_product(
+        [["gpt_raw_answer", "gpt_norm"], list(PROMPT_SUFFIXES)]
+    ))
+    wide.columns = [
+        f"{value}_{PROMPT_SUFFIXES[prompt]}" for value, prompt in wide.columns
+    ]
+    wide = wide.reset_index()
 
     # CASE A: baseline OK → misleading hallucinated
 
-    caseA = merge_base_mis[
-        (merge_base_mis["flag"] == 0) & 
-        (merge_base_mis["gpt_norm_base"] == "no") &   # baseline correct
-        (merge_base_mis["gpt_norm_mis"] == "yes")     # misleading hallucinated
+    caseA = wide.loc[
+        (wide["flag"] == 0) & 
+        (wide["gpt_norm_base"] == "no") &   # baseline correct
+        (wide["gpt_norm_mis"] == "yes"),    # misleading hallucinated
+        keys + [
+            "gpt_raw_answer_base", "gpt_norm_base",
+            "gpt_raw_answer_mis", "gpt_norm_mis",
+        ]
     ]
 
     # CASE B: baseline hallucinated → mitigation fixed
 
-    caseB = merge_base_miti[
-        (merge_base_miti["flag"] == 0) & 
-        (merge_base_miti["gpt_norm_base"] == "yes") &   # baseline hallucinated
-        (merge_base_miti["gpt_norm_miti"] == "no")       # mitigation corrected
+    caseB = wide.loc[
+        (wide["flag"] == 0) & 
+        (wide["gpt_norm_base"] == "yes") &   # baseline hallucinated
+        (wide["gpt_norm_miti"] == "no"),     # mitigation corrected
+        keys + [
+            "gpt_raw_answer_base", "gpt_norm_base",
+            "gpt_raw_answer_miti", "gpt_norm_miti",
+        ]
     ]
 
     return caseA, caseB
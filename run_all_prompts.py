@@ -1,10 +1,18 @@
 import os
-import csv
-import json
+import ast
+import orjson
+import io
 import base64
 import time
+import asyncio
 import logging
-from openai import OpenAI, RateLimitError
+import logging.handlers
+import hashlib
+import sqlite3
+import functools
+import pandas as pd
+from PIL import Image, ImageOps
+from openai import AsyncOpenAI, RateLimitError
 
 
 # CONFIGURATIONS
@@ -30,21 +38,44 @@ GROUNDTRUTH_PATH = "GroundTruth.csv"
 IMAGE_ROOT = "images"
 OUTPUT_DIR = "results"
 LOG_FILE = "run_all_prompts.log"
+B64_CACHE_DIR = os.path.join("cache", "b64")   # encoded images kept between runs
+
+# Larger images are shrunk to this longest side before upload
+# (the API downscales them anyway, so the extra pixels only cost bandwidth)
+MAX_IMAGE_SIDE = 1024
+JPEG_QUALITY = 85
+# Answers already received, so an interrupted run resumes where it stopped.
+# Delete this file to ask everything again, e.g. after editing a prompt template
+# or changing MAX_IMAGE_SIDE / JPEG_QUALITY (answers are not keyed on either).
+ANSWERS_DB = os.path.join("cache", "answers.sqlite")
+
+# Maximum number of API requests in flight at once
+MAX_CONCURRENT_REQUESTS = 32   # <-- lower this if you keep hitting rate limits
 
 
 # LOGGING SETUP
 
+# Records are buffered in memory and written to the log file in batches of
+# LOG_BUFFER_SIZE (or immediately for errors, and on exit)
+LOG_BUFFER_SIZE = 1000
+
+_file_handler = logging.FileHandler(LOG_FILE)
+_file_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+)
+
 logging.basicConfig(
-    filename=LOG_FILE,
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
+    handlers=[
+        logging.handlers.MemoryHandler(LOG_BUFFER_SIZE, target=_file_handler)
+    ]
 )
 
 
 # PROMPT DEFINITIONS
+# Templates are plain strings with an {obj} placeholder, filled in by render()
 
-def baseline_prompt(obj):
-    return f"""
+BASELINE_TPL = """
 You are an image recognition system. I will give you an image and ask whether a specific object is present.
 You must answer strictly with only one word: "yes" or "no". No explanation.
 
@@ -56,8 +87,7 @@ Does this image contain this object?
 
 ########### MISLEADING PROMPTS ###########
 
-def misleading1(obj):
-    return f"""
+MISLEADING1_TPL = """
 You are analyzing this image as part of a visual survey.
 In similar images from this dataset, the object "{obj}" often appears,
 even if partially hidden or small.
@@ -66,8 +96,7 @@ Answer strictly with "yes" or "no":
 Is the object "{obj}" present in this image?
 """
 
-def misleading2(obj):
-    return f"""
+MISLEADING2_TPL = """
 I thought I saw a "{obj}" somewhere in this image, possibly in the background.
 Please confirm my observation.
 
@@ -75,8 +104,7 @@ Answer only with "yes" or "no":
 Is the object "{obj}" actually present in this image?
 """
 
-def misleading3(obj):
-    return f"""
+MISLEADING3_TPL = """
 According to visual statistics, images like this often contain a "{obj}", 
 even if not the main focus.
 
@@ -84,8 +112,7 @@ Answer strictly with "yes" or "no":
 Is a "{obj}" present in this image?
 """
 
-def misleading4(obj):
-    return f"""
+MISLEADING4_TPL = """
 This image appears to show a scene where objects commonly related to "{obj}" may appear.
 
 Based on this context, answer only “yes” or “no”:
@@ -95,8 +122,7 @@ Is a "{obj}" present in the image?
 
 ########### MITIGATION PROMPTS ###########
 
-def mitigate1(obj):
-    return f"""
+MITIGATE1_TPL = """
 You must only answer "yes" if the object is clearly and unambiguously visible in the image.
 If the object cannot be visually confirmed, or is uncertain, answer "no".
 
@@ -106,8 +132,7 @@ Based strictly on visible evidence only, does the image contain this object?
 Answer only "yes" or "no".
 """
 
-def mitigate2(obj):
-    return f"""
+MITIGATE2_TPL = """
 Do not guess.
 If you are not completely certain the object is present, answer "no".
 Never infer or assume anything beyond what is visually obvious.
@@ -118,8 +143,7 @@ Answer strictly "yes" or "no":
 Is this object visible in the image?
 """
 
-def mitigate3(obj):
-    return f"""
+MITIGATE3_TPL = """
 You are a highly cautious visual verification system designed to avoid hallucination.
 You never report an object unless it is clearly identifiable in the pixels.
 
@@ -129,8 +153,7 @@ Answer with "yes" or "no":
 Is this object clearly visible?
 """
 
-def mitigate4(obj):
-    return f"""
+MITIGATE4_TPL = """
 Follow this strict rule:
 
 1. Internally analyze the image and form a detailed understanding of the scene.
@@ -146,19 +169,23 @@ For the final output, answer only with a single word: "yes" or "no".
 # PROMPT BANK (user can choose subset)
 
 PROMPT_TEMPLATES = {
-    "baseline": baseline_prompt,
+    "baseline": BASELINE_TPL,
 
-    "misleading1": misleading1,
-    "misleading2": misleading2,
-    "misleading3": misleading3,
-    "misleading4": misleading4,
+    "misleading1": MISLEADING1_TPL,
+    "misleading2": MISLEADING2_TPL,
+    "misleading3": MISLEADING3_TPL,
+    "misleading4": MISLEADING4_TPL,
 
-    "mitigate1": mitigate1,
-    "mitigate2": mitigate2,
-    "mitigate3": mitigate3,
-    "mitigate4": mitigate4,
+    "mitigate1": MITIGATE1_TPL,
+    "mitigate2": MITIGATE2_TPL,
+    "mitigate3": MITIGATE3_TPL,
+    "mitigate4": MITIGATE4_TPL,
 }
 
+def render(prompt_key, obj):
+    return PROMPT_TEMPLATES[prompt_key].format(obj=obj)
+
+
 # User chooses which prompt modes to run
 PROMPTS_TO_RUN = [
     "baseline",
@@ -180,18 +207,18 @@ API_KEY = os.getenv("OPENAI_API_KEY")   # No key in code, please set your API KE
 if API_KEY is None:
     raise ValueError("OPENAI_API_KEY is not set in your environment variables.")
 
-client = OpenAI(api_key=API_KEY)
+client = AsyncOpenAI(api_key=API_KEY)
 
-def call_with_retries(func, max_retries=8):
+async def call_with_retries(func, max_retries=8):
     """
-    Wrap any OpenAI API call with automatic retries using exponential backoff.
+    Wrap any async OpenAI API call with automatic retries using exponential backoff.
     - If API provides a 'try again in X ms', we honor it.
     - Otherwise we use exponential backoff: 1s, 2s, 4s, 8s, ...
     """
 
     for retry in range(max_retries):
         try:
-            return func()   # attempt the call
+            return await func()   # attempt the call
 
         except RateLimitError as e:
             # Try-extract "Retry-After" from error (very reliable)
@@ -204,7 +231,7 @@ def call_with_retries(func, max_retries=8):
                     ms = int(msg.split("try again in")[1].split("ms")[0].strip())
                     wait = ms / 1000
                     logging.warning(f"Waiting {wait:.3f} seconds (from API suggestion)")
-                    time.sleep(wait)
+                    await asyncio.sleep(wait)
                     continue
                 except:
                     pass  # fallback to exponential
@@ -212,7 +239,7 @@ def call_with_retries(func, max_retries=8):
             # Case 2: fallback → exponential backoff
             wait = min(2 ** retry, 30)  # cap at 30 seconds
             logging.warning(f"Retrying in {wait} seconds (exponential backoff)")
-            time.sleep(wait)
+            await asyncio.sleep(wait)
 
         except Exception as e:
             logging.error(f"Non-rate-limit error during API call: {e}")
@@ -228,13 +255,66 @@ def is_gpt5_model(model_name):
     """
     return model_name.startswith("gpt-5")
 
-def ask_gpt(image_path, object_name, prompt_fn):
-    with open(image_path, "rb") as f:
-        img_b64 = base64.b64encode(f.read()).decode("utf-8")
+def read_image_bytes(image_path):
+    """
+    Return the JPEG bytes to upload for an image.
+    Images already within MAX_IMAGE_SIDE are sent unchanged; larger ones
+    are downscaled (keeping aspect ratio) and re-encoded as JPEG.
+    """
+    with Image.open(image_path) as img:
+        if max(img.size) <= MAX_IMAGE_SIDE:
+            with open(image_path, "rb") as f:
+                return f.read()
+
+        img = ImageOps.exif_transpose(img)   # keep orientation, EXIF is dropped on save
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS)
 
-    prompt = prompt_fn(object_name)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+        return buf.getvalue()
+
+def load_image_b64(image_path):
+    """
+    Return the base64 encoding of an image, using an on-disk cache so
+    re-runs of the script do not re-encode unchanged images.
+    The cache key includes the file's mtime and the resize settings, so
+    edited images (or changed settings) are re-encoded.
+    """
+    mtime_ns = os.stat(image_path).st_mtime_ns
+    key_src = f"{image_path}:{mtime_ns}:{MAX_IMAGE_SIDE}:{JPEG_QUALITY}"
+    key = hashlib.sha1(key_src.encode("utf-8")).hexdigest()
+    cache_path = os.path.join(B64_CACHE_DIR, f"{key}.b64")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read().decode("ascii")
+
+    img_b64 = base64.b64encode(read_image_bytes(image_path)).decode("ascii")
+
+    # Write to a temp file first so an interrupted run never leaves a partial entry
+    os.makedirs(B64_CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(img_b64.encode("ascii"))
+    os.replace(tmp_path, cache_path)
+
+    return img_b64
+
+@functools.lru_cache(maxsize=4096)
+def encode_image(image_path):
+    """
+    Return an image as a base64 data URL.
+    Cached in memory, so each image is encoded only once across all
+    objects and prompt modes (on top of the on-disk cache).
+    """
+    return f"data:image/jpeg;base64,{load_image_b64(image_path)}"
 
-    def api_call():
+async def ask_gpt(img_url, object_name, prompt_key):
+    prompt = render(prompt_key, object_name)
+
+    async def api_call():
         kwargs = {
             "model": MODEL_TO_USE,
             "messages": [
@@ -244,7 +324,7 @@ def ask_gpt(image_path, object_name, prompt_fn):
                         {"type": "text", "text": prompt},
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}
+                            "image_url": {"url": img_url}
                         },
                     ],
                 }
@@ -257,50 +337,112 @@ def ask_gpt(image_path, object_name, prompt_fn):
         else:
             kwargs["max_tokens"] = 5
 
-        return client.chat.completions.create(**kwargs)
+        return await client.chat.completions.create(**kwargs)
 
-    resp = call_with_retries(api_call)
+    resp = await call_with_retries(api_call)
     return resp.choices[0].message.content.strip()
 
 
+# Ground truth: loaded and parsed once, shared by every prompt mode
+
+def load_groundtruth():
+    gt = pd.read_csv(GROUNDTRUTH_PATH, encoding="utf-8")
+
+    # Only run for selected folders
+    gt = gt[gt["foldername"].isin(TARGET_FOLDERS)].copy()
+
+    # "no" column holds Python list literals, e.g. "['bench', 'bus']"
+    gt["no"] = gt["no"].map(ast.literal_eval)
+    return gt
+
+
+# Saved answers store (resume support)
+
+def open_answers_db():
+    os.makedirs(os.path.dirname(ANSWERS_DB), exist_ok=True)
+    conn = sqlite3.connect(ANSWERS_DB)
+    # WAL + synchronous=NORMAL: commits append to the log without an fsync each,
+    # so per-answer commits stay cheap but still survive the process being killed
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS answers (
+            model TEXT, prompt TEXT, filename TEXT, object TEXT, answer TEXT,
+            PRIMARY KEY (model, prompt, filename, object)
+        )
+        """
+    )
+    return conn
+
+def load_saved_answers(conn, prompt_key):
+    rows = conn.execute(
+        "SELECT filename, object, answer FROM answers WHERE model = ? AND prompt = ?",
+        (MODEL_TO_USE, prompt_key)
+    )
+    return {(filename, obj): answer for filename, obj, answer in rows}
+
+
 # Main routine for one prompt_type
 
-def run_prompt_mode(prompt_key):
-    prompt_fn = PROMPT_TEMPLATES[prompt_key]
-    results = []
+async def run_prompt_mode(prompt_key, gt):
+    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    tasks = []
+
+    conn = open_answers_db()
+    saved = load_saved_answers(conn, prompt_key)
+    if saved:
+        logging.info("Reusing %d saved answers for Model=%s Prompt=%s", len(saved), MODEL_TO_USE, prompt_key)
 
-    with open(GROUNDTRUTH_PATH, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+    async def run_one(img_url, folder, filename, obj):
+        raw_ans = saved.get((filename, obj))
 
-        for row in reader:
-            folder = row["foldername"]
-            filename = row["filename"]
+        if raw_ans is None:
+            async with sem:
+                logging.info("Model=%s Prompt=%s Image=%s Object=%s", MODEL_TO_USE, prompt_key, filename, obj)
 
-            # Only run for selected folders
-            if folder not in TARGET_FOLDERS:
-                continue
+                raw_ans = await ask_gpt(img_url, obj, prompt_key)
 
-            no_list = eval(row["no"])
-            image_path = os.path.join(IMAGE_ROOT, folder, filename)
+            # Commit each answer right away so it survives an interrupted run
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (MODEL_TO_USE, prompt_key, filename, obj, raw_ans)
+            )
+            conn.commit()
 
-            if not os.path.exists(image_path):
-                logging.warning(f"Missing image: {image_path}")
-                continue
+        return {
+            "model": MODEL_TO_USE,
+            "prompt": prompt_key,
+            "filename": filename,
+            "foldername": folder,
+            "object": obj,
+            "flag": 0,
+            "gpt_raw_answer": raw_ans,
+        }
 
-            for obj in no_list:
-                logging.info(f"Model={MODEL_TO_USE} Prompt={prompt_key} Image={filename} Object={obj}")
+    for row in gt.itertuples(index=False):
+        folder = row.foldername
+        filename = row.filename
+        image_path = os.path.join(IMAGE_ROOT, folder, filename)
 
-                raw_ans = ask_gpt(image_path, obj, prompt_fn)
+        if not os.path.exists(image_path):
+            logging.warning("Missing image: %s", image_path)
+            continue
 
-                results.append({
-                    "model": MODEL_TO_USE,
-                    "prompt": prompt_key,
-                    "filename": filename,
-                    "foldername": folder,
-                    "object": obj,
-                    "flag": 0,
-                    "gpt_raw_answer": raw_ans,
-                })
+        # Encode (and maybe resize) the image now, before any request is in
+        # flight, so this CPU/disk work never stalls the event loop during gather.
+        # Skipped when every object of this image already has a saved answer.
+        needs_api = any((filename, obj) not in saved for obj in row.no)
+        img_url = encode_image(image_path) if needs_api else None
+
+        for obj in row.no:
+            tasks.append(run_one(img_url, folder, filename, obj))
+
+    # gather keeps the results in the same order as the tasks were created
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        conn.close()
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -309,22 +451,25 @@ def run_prompt_mode(prompt_key):
         f"{MODEL_TO_USE}_{prompt_key}_results.json"
     )
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4)
+    # orjson returns bytes, so the whole file goes out in one write
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
     logging.info(f"Saved file: {out_path}")
 
 
 # MAIN — run for all selected prompts
 
-def main():
+async def main():
     start = time.time()
 
     if MODEL_TO_USE not in AVAILABLE_MODELS:
         logging.warning(f"Model '{MODEL_TO_USE}' is not known in 2025 model list.")
 
+    gt = load_groundtruth()
+
     for key in PROMPTS_TO_RUN:
-        run_prompt_mode(key)
+        await run_prompt_mode(key, gt)
 
     end = time.time()
     elapsed = round(end - start, 2)
@@ -332,5 +477,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
-
+    asyncio.run(main())